@@ -1,6 +1,8 @@
-import json
 import os
 import logging
+from pathlib import Path
+
+import orjson
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -36,8 +38,7 @@ def get_credentials(data_dir: str, credentials_path: str = DEFAULT_CREDENTIALS_F
 
     # Check if token exists and load it
     if os.path.exists(token_path):
-        with open(token_path, "r") as token_file:
-            credentials = Credentials.from_authorized_user_info(json.load(token_file))
+        credentials = Credentials.from_authorized_user_info(orjson.loads(Path(token_path).read_bytes()))
 
     # If credentials are missing or expired, refresh or re-authenticate
     if not credentials or not credentials.valid:
@@ -50,8 +51,7 @@ def get_credentials(data_dir: str, credentials_path: str = DEFAULT_CREDENTIALS_F
             credentials = flow.run_local_server(port=0)
 
             # Save new credentials
-            with open(token_path, "w") as token_file:
-                token_file.write(credentials.to_json())
+            Path(token_path).write_text(credentials.to_json())
 
     logger.info("Authentication successful.")
     return credentials
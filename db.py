@@ -1,10 +1,49 @@
+import copy
 import os
 import duckdb
-import pandas as pd
-from datetime import datetime
+import pyarrow as pa
+from datetime import datetime, timezone
+
+from message import MessageBatch
 
 DB_FILE = "messages.duckdb"
 
+# Arrow layout of the messages table; column order matches positional appends
+MESSAGE_SCHEMA = pa.schema(
+    [
+        ("message_id", pa.string()),
+        ("thread_id", pa.string()),
+        ("sender", pa.large_string()),
+        ("recipients", pa.large_string()),
+        ("labels", pa.large_string()),
+        ("subject", pa.string()),
+        ("body", pa.large_string()),
+        ("size", pa.int32()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("is_read", pa.bool_()),
+        ("is_outgoing", pa.bool_()),
+        ("last_indexed", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
+
+def build_record_batch(batch: MessageBatch) -> pa.RecordBatch:
+    """
+    Converts a message batch into a typed Arrow record batch.
+
+    The fixed schema means DuckDB scans the columns zero-copy without any
+    type inference.
+
+    Args:
+        batch (MessageBatch): The messages to convert.
+
+    Returns:
+        pyarrow.RecordBatch: The messages, stamped with the current last_indexed time.
+    """
+    columns = batch.columns()
+    columns["last_indexed"] = [datetime.now(timezone.utc)] * len(batch)
+    return pa.RecordBatch.from_pydict(columns, schema=MESSAGE_SCHEMA)
+
 
 class DuckDB:
     """
@@ -16,6 +55,20 @@ class DuckDB:
         self.conn = duckdb.connect(self.db_path)
         self.init_db()
 
+    def cursor(self) -> "DuckDB":
+        """
+        Returns a DuckDB instance on a new cursor of this connection.
+
+        DuckDB connections must not be shared between threads; every thread
+        should work through its own cursor.
+
+        Returns:
+            DuckDB: An instance sharing this database.
+        """
+        db = copy.copy(self)
+        db.conn = self.conn.cursor()
+        return db
+
     def init_db(self):
         """
         Initializes the database schema if it does not exist.
@@ -36,55 +89,73 @@ class DuckDB:
                 last_indexed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(timestamp)")
+
+        # Single-row table tracking the newest message timestamp, seeded once from existing data
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (max_ts TIMESTAMP)")
+        self.conn.execute("""
+            INSERT INTO sync_state
+            SELECT max_ts FROM (SELECT MAX(timestamp) AS max_ts FROM messages)
+            WHERE NOT EXISTS (SELECT 1 FROM sync_state)
+        """)
 
-    def bulk_insert_messages(self, messages: list[dict]):
+    def advance_sync_state(self, written):
+        """
+        Advances the tracked newest message timestamp past a freshly written batch.
+
+        Args:
+            written: Arrow batch or DuckDB relation with the written rows' timestamp column.
+        """
+        self.conn.execute("""
+            UPDATE sync_state SET max_ts = batch.max_ts
+            FROM (SELECT MAX(timestamp)::TIMESTAMP AS max_ts FROM written) AS batch
+            WHERE batch.max_ts IS NOT NULL
+              AND (sync_state.max_ts IS NULL OR sync_state.max_ts < batch.max_ts)
+        """)
+
+    def bulk_insert_messages(self, batch: MessageBatch):
         """
         Inserts a batch of messages into DuckDB.
 
         Args:
-            messages (list[dict]): List of messages to insert.
+            batch (MessageBatch): Messages to insert.
         """
-        if not messages:
+        if not batch:
             return
 
-        df = pd.DataFrame(messages)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df["last_indexed"] = pd.Timestamp.now()
-
-        self.conn.execute("INSERT INTO messages SELECT * FROM df")
+        rb = build_record_batch(batch)
+        self.conn.from_arrow(rb).insert_into("messages")
+        self.advance_sync_state(rb)
 
-    def upsert_messages(self, messages: list[dict]):
+    def upsert_messages(self, batch: MessageBatch):
         """
         Inserts new messages and updates existing ones in a single batch operation.
 
         Args:
-            messages (list[dict]): List of messages to insert or update.
+            batch (MessageBatch): Messages to insert or update.
         """
-        if not messages:
+        if not batch:
             return
 
-        df = pd.DataFrame(messages)
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-        df["last_indexed"] = pd.Timestamp.now()
-
-        self.conn.execute("""
-            CREATE TEMP TABLE new_messages AS SELECT * FROM df
-        """)
-
-        self.conn.execute("""
-            MERGE INTO messages AS target
-            USING new_messages AS source
-            ON target.message_id = source.message_id
-            WHEN MATCHED THEN
-                UPDATE SET
-                    is_read = source.is_read,
-                    last_indexed = source.last_indexed,
-                    labels = source.labels
-            WHEN NOT MATCHED THEN
-                INSERT *;
-        """)
-
-        self.conn.execute("DROP TABLE new_messages")
+        rb = build_record_batch(batch)
+        self.conn.register("batch_upsert", rb)
+        try:
+            self.conn.execute("""
+                INSERT INTO messages SELECT * FROM batch_upsert
+                ON CONFLICT (message_id) DO UPDATE SET
+                    is_read = excluded.is_read,
+                    labels = excluded.labels,
+                    last_indexed = excluded.last_indexed
+            """)
+
+            # Conflicting rows keep their stored timestamp, so advance from what is stored
+            stored = self.conn.sql("""
+                SELECT timestamp FROM messages
+                WHERE message_id IN (SELECT message_id FROM batch_upsert)
+            """)
+            self.advance_sync_state(stored)
+        finally:
+            self.conn.unregister("batch_upsert")
 
     def get_last_indexed_timestamp(self):
         """
@@ -93,8 +164,8 @@ class DuckDB:
         Returns:
             datetime.datetime or None
         """
-        result = self.conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()
-        return result[0] if result[0] else None
+        result = self.conn.execute("SELECT max_ts FROM sync_state").fetchone()
+        return result[0] if result and result[0] else None
 
     def get_first_indexed_timestamp(self):
         """
@@ -116,7 +187,8 @@ class DuckDB:
         Returns:
             list[dict]: A list of messages as dictionaries.
         """
-        df = self.conn.execute(
-            f"SELECT * FROM messages ORDER BY timestamp DESC LIMIT {limit}"
-        ).fetchdf()
-        return df.to_dict(orient="records")
+        return (
+            self.conn.execute("SELECT * FROM messages ORDER BY timestamp DESC LIMIT ?", [limit])
+            .to_arrow_table()
+            .to_pylist()
+        )
@@ -36,7 +36,7 @@ if __name__ == "__main__":
     db = DuckDB(args.data_dir)
 
     if args.command == "sync":
-        total_synced = sync.fetch_all_messages(credentials, full_sync=args.full_sync)
+        total_synced = sync.fetch_all_messages(credentials, db, full_sync=args.full_sync)
         print(f"Total messages synced: {total_synced}")
 
     elif args.command == "sync-message":
@@ -1,11 +1,174 @@
 import base64
 import logging
+import re
+from datetime import datetime, timedelta, timezone
 from email.utils import parseaddr, parsedate_to_datetime
+from functools import lru_cache
 
+import orjson
 from bs4 import BeautifulSoup
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # selectolax missing or too old for the lexbor backend
+    LexborHTMLParser = None
+
+# Matches the common `Name <email>`, `"Name" <email>` and bare `email` forms.
+# Anything with comments, escapes or other specials falls back to parseaddr.
+_ADDR_RE = re.compile(
+    r'\s*(?:"(?P<quoted>[^"\\]*)"|(?P<name>[^"<>()\[\]\\,;:@.]*?))\s*'
+    r'<(?P<angle>[^<>()\[\]\\,;:@\s"]+@[^<>()\[\]\\,;:@\s"]+)>\s*'
+    r'|\s*(?P<bare>[^<>()\[\]\\,;:@\s"]+@[^<>()\[\]\\,;:@\s"]+)\s*'
+)
+
+
+@lru_cache(maxsize=100_000)
+def _parse_address(address: str) -> tuple:
+    """
+    Parse a single email address, equivalent to email.utils.parseaddr.
+
+    Results are cached since the same senders repeat across a sync.
+
+    Args:
+        address (str): The raw address.
+
+    Returns:
+        tuple[str, str]: The name and email.
+    """
+    match = _ADDR_RE.fullmatch(address)
+    if match is None:
+        return parseaddr(address)
+    if match["bare"] is not None:
+        return "", match["bare"]
+    if match["quoted"] is not None:
+        return match["quoted"], match["angle"]
+    return " ".join(match["name"].split()), match["angle"]
+
+
+# Headers Message.parse reads; all others are skipped without being stored
+_STORED_HEADERS = frozenset(("from", "to", "cc", "bcc", "subject", "date"))
+
+_MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+
+
+@lru_cache(maxsize=None)
+def _timezone(offset: str):
+    """
+    Returns the tzinfo for a `+hhmm`/`-hhmm` offset, None for `-0000` (unknown zone).
+    """
+    if offset == "-0000":
+        return None
+    minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+    return timezone(timedelta(minutes=-minutes if offset[0] == "-" else minutes))
+
+
+def _fast_rfc2822(date: str) -> datetime:
+    """
+    Parse an RFC 2822 date, equivalent to email.utils.parsedate_to_datetime.
+
+    The canonical `Wed, 02 Oct 2024 10:20:30 +0000` shape, with or without the
+    weekday, is sliced directly; anything else falls back to the stdlib parser.
+
+    Args:
+        date (str): The Date header value.
+
+    Returns:
+        datetime.datetime: The parsed date.
+    """
+    s = date[5:] if date[3:5] == ", " else date
+    try:
+        if (
+            len(s) == 26
+            and s[2] == " " and s[6] == " " and s[11] == " " and s[20] == " "
+            and s[14] == ":" and s[17] == ":"
+            and s[21] in "+-"
+            and (s[0:2] + s[7:11] + s[12:14] + s[15:17] + s[18:20] + s[22:26]).isdigit()
+        ):
+            return datetime(
+                int(s[7:11]),
+                _MONTHS[s[3:6]],
+                int(s[0:2]),
+                int(s[12:14]),
+                int(s[15:17]),
+                int(s[18:20]),
+                tzinfo=_timezone(s[21:26]),
+            )
+    except (KeyError, ValueError):
+        pass
+    return parsedate_to_datetime(date)
+
+
+def _decode_data(data: str) -> str:
+    """
+    Decode a base64url-encoded Gmail body.
+
+    Args:
+        data (str): The encoded body data.
+
+    Returns:
+        str: The decoded body, or an empty string if it cannot be decoded.
+    """
+    try:
+        return base64.urlsafe_b64decode(data).decode("utf-8")
+    except Exception as e:
+        logging.warning(f"Failed to decode message body: {e}")
+        return ""
+
+
+# Label mapping of a parser worker process, set once by init_parser
+_worker_labels = {}
+
+
+def init_parser(labels: dict) -> None:
+    """
+    Initializes a parser worker process.
+
+    Args:
+        labels (dict): A dictionary mapping Gmail label IDs to label names.
+    """
+    global _worker_labels
+    _worker_labels = labels
+
+
+def parse_batch(raws: list) -> "MessageBatch":
+    """
+    Parses raw Gmail API messages inside a parser worker process.
+
+    Messages that fail to parse are logged and skipped.
+
+    Args:
+        raws (list[dict]): The raw messages.
+
+    Returns:
+        MessageBatch: The parsed messages.
+    """
+    batch = MessageBatch()
+    for raw in raws:
+        try:
+            batch.append(Message.from_raw(raw, _worker_labels))
+        except Exception as e:
+            logging.error(f"Failed to parse message {raw.get('id')}: {e}")
+    return batch
+
 
 class Message:
+    __slots__ = (
+        "id",
+        "thread_id",
+        "sender",
+        "recipients",
+        "labels",
+        "subject",
+        "body",
+        "size",
+        "timestamp",
+        "is_read",
+        "is_outgoing",
+    )
+
     def __init__(self):
         self.id = None
         self.thread_id = None
@@ -48,34 +211,11 @@ class Message:
         parsed_addresses = []
         if addresses:
             for address in addresses.split(","):
-                name, email = parseaddr(address)
+                name, email = _parse_address(address)
                 if email:
                     parsed_addresses.append({"email": email.lower(), "name": name})
         return parsed_addresses
 
-    def decode_body(self, part) -> str:
-        """
-        Recursively decodes the body of a Gmail message.
-
-        Args:
-            part (dict): A message part.
-
-        Returns:
-            str: The decoded message body.
-        """
-        if "body" in part and "data" in part["body"]:
-            try:
-                return base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8")
-            except Exception as e:
-                logging.warning(f"Failed to decode message body: {e}")
-                return ""
-        elif "parts" in part:
-            for subpart in part["parts"]:
-                decoded_body = self.decode_body(subpart)
-                if decoded_body:
-                    return decoded_body
-        return ""
-
     def html2text(self, html: str) -> str:
         """
         Convert HTML to plain text.
@@ -86,6 +226,14 @@ class Message:
         Returns:
             str: Extracted plain text.
         """
+        if LexborHTMLParser is not None:
+            try:
+                tree = LexborHTMLParser(html)
+                tree.strip_tags(["script", "style"])
+                return tree.text()
+            except Exception as e:
+                logging.warning(f"Falling back to BeautifulSoup for HTML body: {e}")
+
         soup = BeautifulSoup(html, features="html.parser")
         return soup.get_text()
 
@@ -100,21 +248,30 @@ class Message:
         Returns:
             None
         """
+        payload = msg.get("payload") or {}
         self.id = msg.get("id")
         self.thread_id = msg.get("threadId")
         self.size = msg.get("sizeEstimate", 0)
 
-        # Parse headers
-        headers = {header["name"].lower(): header["value"] for header in msg.get("payload", {}).get("headers", [])}
+        # Parse headers, keeping only the ones stored in the messages table
+        headers = {}
+        for header in payload.get("headers", ()):
+            name = header["name"].lower()
+            if name in _STORED_HEADERS:
+                headers[name] = header["value"]
 
-        self.sender = {"name": "", "email": ""}
-        if "from" in headers:
-            name, email = parseaddr(headers["from"])
+        sender = headers.get("from")
+        if sender is not None:
+            name, email = _parse_address(sender)
             self.sender = {"name": name, "email": email}
+        else:
+            self.sender = {"name": "", "email": ""}
 
-        self.recipients["to"] = self.parse_addresses(headers.get("to", ""))
-        self.recipients["cc"] = self.parse_addresses(headers.get("cc", ""))
-        self.recipients["bcc"] = self.parse_addresses(headers.get("bcc", ""))
+        parse_addresses = self.parse_addresses
+        recipients = self.recipients
+        recipients["to"] = parse_addresses(headers.get("to", ""))
+        recipients["cc"] = parse_addresses(headers.get("cc", ""))
+        recipients["bcc"] = parse_addresses(headers.get("bcc", ""))
 
         self.subject = headers.get("subject", "")
 
@@ -122,19 +279,19 @@ class Message:
         date_header = headers.get("date")
         if date_header:
             try:
-                self.timestamp = parsedate_to_datetime(date_header)
+                self.timestamp = _fast_rfc2822(date_header)
             except Exception as e:
                 logging.warning(f"Failed to parse email date: {date_header} - {e}")
                 self.timestamp = None
 
         # Parse labels
-        if "labelIds" in msg:
-            self.labels = [labels.get(l, l) for l in msg["labelIds"]]
-            self.is_read = "UNREAD" not in msg["labelIds"]
-            self.is_outgoing = "SENT" in msg["labelIds"]
+        label_ids = msg.get("labelIds")
+        if label_ids is not None:
+            self.labels = [labels.get(l, l) for l in label_ids]
+            self.is_read = "UNREAD" not in label_ids
+            self.is_outgoing = "SENT" in label_ids
 
         # Extract body
-        payload = msg.get("payload", {})
         self.body = self.extract_body(payload)
 
     def extract_body(self, payload: dict) -> str:
@@ -150,21 +307,96 @@ class Message:
         if not payload:
             return ""
 
-        # Try direct extraction
-        if "body" in payload and "data" in payload["body"]:
-            try:
-                return self.html2text(base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8"))
-            except Exception as e:
-                logging.warning(f"Error decoding email body: {e}")
-                return ""
-
-        # Check parts
-        if "parts" in payload:
-            for part in payload["parts"]:
+        # Walk the parts tree once, returning the first plain-text part as is.
+        # HTML is only converted when no plain-text alternative exists.
+        html_part = None
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            body = part.get("body", {})
+            if "data" in body and body.get("size", 0):
                 mime_type = part.get("mimeType", "")
-                if mime_type in ["text/plain", "text/html", "multipart/related", "multipart/alternative"]:
-                    extracted_body = self.decode_body(part)
-                    if extracted_body:
-                        return self.html2text(extracted_body)
+                if mime_type == "text/plain":
+                    return _decode_data(body["data"])
+                if html_part is None and (mime_type == "text/html" or part is payload):
+                    html_part = part
+            stack.extend(reversed(part.get("parts", [])))
 
+        if html_part is not None:
+            return self.html2text(_decode_data(html_part["body"]["data"]))
         return ""
+
+
+class MessageBatch:
+    """
+    Column-oriented accumulator of parsed messages.
+
+    Every field is kept in its own list, in messages table order, so a batch
+    converts into typed columns without building a dict per message.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.thread_ids = []
+        self.senders = []
+        self.recipients = []
+        self.labels = []
+        self.subjects = []
+        self.bodies = []
+        self.sizes = []
+        self.timestamps = []
+        self.is_read = []
+        self.is_outgoing = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, msg: Message) -> None:
+        """
+        Append a parsed message, serializing its JSON fields.
+
+        Args:
+            msg (Message): The parsed message.
+        """
+        self.ids.append(msg.id)
+        self.thread_ids.append(msg.thread_id)
+        self.senders.append(orjson.dumps(msg.sender).decode())
+        self.recipients.append(orjson.dumps(msg.recipients).decode())
+        self.labels.append(orjson.dumps(msg.labels).decode())
+        self.subjects.append(msg.subject)
+        self.bodies.append(msg.body)
+        self.sizes.append(msg.size)
+        self.timestamps.append(msg.timestamp)
+        self.is_read.append(msg.is_read)
+        self.is_outgoing.append(msg.is_outgoing)
+
+    def extend(self, other: "MessageBatch") -> None:
+        """
+        Append all messages of another batch.
+
+        Args:
+            other (MessageBatch): The batch to append.
+        """
+        for name, column in vars(self).items():
+            column.extend(getattr(other, name))
+
+    def columns(self) -> dict:
+        """
+        Returns the batch keyed by messages table column, without last_indexed.
+
+        Returns:
+            dict[str, list]: The column values.
+        """
+        return {
+            "message_id": self.ids,
+            "thread_id": self.thread_ids,
+            "sender": self.senders,
+            "recipients": self.recipients,
+            "labels": self.labels,
+            "subject": self.subjects,
+            "body": self.bodies,
+            "size": self.sizes,
+            "timestamp": self.timestamps,
+            "is_read": self.is_read,
+            "is_outgoing": self.is_outgoing,
+        }
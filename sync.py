@@ -1,40 +1,44 @@
-import json
 import logging
+import multiprocessing
+import os
+import random
+import threading
 import time
-import duckdb
-import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import suppress
+from queue import Full, Queue
 
+import httplib2
+import orjson
+
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from message import Message
+from googleapiclient.model import JsonModel
+from db import DuckDB
+from message import MessageBatch, init_parser, parse_batch
 from auth import get_credentials
 
 MAX_RESULTS = 500
-BATCH_SIZE = 50  # Fetch emails in batches
+BATCH_SIZE = 100  # Gmail caps batch HTTP requests at 100 calls
+LIST_FIELDS = "messages/id,nextPageToken"  # Only the fields the sync reads from listings
+MAX_CONCURRENCY = 10  # Batch requests kept in flight at once
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1  # Seconds, doubled on every retry and jittered
+RETRY_STATUSES = {429, 500, 503}
+TRANSPORT_ERRORS = (httplib2.HttpLib2Error, OSError)  # Dropped connections and socket timeouts
+FLUSH_ROWS = 10_000  # Rows buffered before each insert into DuckDB
+PARSE_CHUNK = 32  # Messages handed to a parser process at once
+PARSE_BACKLOG_PER_CPU = 4  # Queued parse chunks per CPU before listing pauses
+WRITE_QUEUE_SIZE = 4  # Flushed batches waiting for the writer thread
+WRITE_POLL_INTERVAL = 1  # Seconds between writer liveness checks while the queue is full
+
+_ABORT = object()  # Queued instead of None to roll the sync transaction back
 
 # Initialize logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# DuckDB database connection
-db_path = "mailduck.db"
-conn = duckdb.connect(db_path)
-conn.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-        message_id TEXT PRIMARY KEY,
-        thread_id TEXT,
-        sender JSON,
-        recipients JSON,
-        labels JSON,
-        subject TEXT,
-        body TEXT,
-        size INTEGER,
-        timestamp TIMESTAMP,
-        is_read BOOLEAN,
-        is_outgoing BOOLEAN,
-        last_indexed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-""")
 
 def get_labels(service) -> dict:
     """
@@ -50,12 +54,44 @@ def get_labels(service) -> dict:
     return labels
 
 
-def fetch_all_messages(credentials, full_sync=False) -> int:
+class OrjsonModel(JsonModel):
+    """
+    JSON model that parses Gmail API responses with orjson.
+    """
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+
+_thread_local = threading.local()
+
+
+def _thread_http(credentials):
+    """
+    Returns an authorized HTTP client owned by the calling thread.
+
+    httplib2 is not thread-safe, so every worker keeps its own connection.
+    """
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = AuthorizedHttp(credentials, http=httplib2.Http())
+        _thread_local.http = http
+    return http
+
+
+def fetch_all_messages(credentials, db, full_sync=False) -> int:
     """
     Fetches all messages from Gmail API and stores them in DuckDB.
 
     Args:
         credentials (object): Authenticated credentials.
+        db (DuckDB): Database the messages are written to.
         full_sync (bool): Whether to perform a full sync.
 
     Returns:
@@ -64,112 +100,283 @@ def fetch_all_messages(credentials, full_sync=False) -> int:
 
     query = []
     if not full_sync:
-        last_timestamp = get_last_indexed_timestamp()
+        last_timestamp = db.get_last_indexed_timestamp()
         if last_timestamp:
             query.append(f"after:{int(last_timestamp.timestamp())}")
 
-    service = build("gmail", "v1", credentials=credentials)
+    service = build("gmail", "v1", credentials=credentials, model=OrjsonModel())
     labels = get_labels(service)
 
-    page_token = None
-    total_messages = 0
-    batch = []
-
-    while True:
+    # DuckDB writes run on their own thread and cursor, overlapping with fetching
+    writes = Queue(maxsize=WRITE_QUEUE_SIZE)
+    with ThreadPoolExecutor(max_workers=1) as writer_pool:
+        writer = writer_pool.submit(write_batches, db.cursor(), writes)
         try:
-            response = (
-                service.users()
-                .messages()
-                .list(userId="me", maxResults=MAX_RESULTS, pageToken=page_token, q=" ".join(query))
-                .execute()
-            )
+            total_messages = stream_messages(credentials, service, labels, " ".join(query), writes, writer)
+            queue_write(writes, writer, None)
+        except BaseException:
+            with suppress(Exception):
+                queue_write(writes, writer, _ABORT)
+            raise
+        writer.result()
 
-            messages = response.get("messages", [])
-            total_messages += len(messages)
+    return total_messages
 
-            if not messages:
-                break
 
-            # Fetch message details in batches
-            for i in range(0, len(messages), BATCH_SIZE):
-                batch_ids = [m["id"] for m in messages[i : i + BATCH_SIZE]]
-                batch.extend(fetch_message_batch(service, batch_ids, labels))
+def stream_messages(credentials, service, labels, q, writes, writer) -> int:
+    """
+    Fetches and parses all messages matching a query, queueing them for writing.
 
-                if len(batch) >= 100:  # Insert in chunks of 100
-                    save_to_duckdb(batch)
-                    batch.clear()
+    Stops early, re-raising the writer's error, as soon as the writer fails.
 
-            if "nextPageToken" in response:
-                page_token = response["nextPageToken"]
-            else:
-                break
+    Args:
+        credentials (object): Authenticated credentials.
+        service: Gmail API service instance.
+        labels (dict): A dictionary mapping Gmail label IDs to label names.
+        q (str): Gmail search query.
+        writes (Queue): Queue receiving MessageBatch objects of up to FLUSH_ROWS messages.
+        writer (Future): The writer thread consuming the queue.
+
+    Returns:
+        int: Number of messages fetched.
+    """
+
+    def list_page(page_token):
+        return (
+            service.users()
+            .messages()
+            .list(userId="me", maxResults=MAX_RESULTS, pageToken=page_token, q=q, fields=LIST_FIELDS)
+            .execute(http=_thread_http(credentials), num_retries=MAX_RETRIES)
+        )
 
-        except HttpError as e:
-            logger.error(f"Gmail API error: {e}")
-            time.sleep(5)  # Retry delay
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+    def fetch_batch(message_ids):
+        return fetch_message_batch(service, message_ids, http=_thread_http(credentials))
+
+    page_token = None
+    total_messages = 0
+    batch = MessageBatch()
+    in_flight = set()  # Batch fetches
+    parsing = set()  # Parse chunks
+    cpus = os.cpu_count() or 1
+
+    # One extra worker prefetches the next listing page while batches are fetched,
+    # and parsing runs in separate processes while further batches download.
+    # forkserver avoids fork()ing this process while its worker threads are running.
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY + 1) as executor, ProcessPoolExecutor(
+        max_workers=cpus, mp_context=_parser_context(), initializer=init_parser, initargs=(labels,)
+    ) as parser:
+        page = executor.submit(list_page, page_token)
+
+        while page is not None or in_flight or parsing:
+            raise_if_stopped(writer)
+
+            # Keep listing while fewer than MAX_CONCURRENCY fetches are in flight
+            # and the parsers are keeping up; otherwise wait for work to finish
+            if page is not None and len(in_flight) < MAX_CONCURRENCY and len(parsing) < PARSE_BACKLOG_PER_CPU * cpus:
+                try:
+                    response = page.result()
+                except HttpError as e:
+                    logger.error(f"Gmail API error: {e}")
+                    time.sleep(5)  # Retry delay
+                    page = executor.submit(list_page, page_token)
+                    continue
+
+                messages = response.get("messages", [])
+                total_messages += len(messages)
+
+                page_token = response.get("nextPageToken")
+                page = executor.submit(list_page, page_token) if messages and page_token else None
+
+                # Fetch message details in batches
+                for i in range(0, len(messages), BATCH_SIZE):
+                    batch_ids = [m["id"] for m in messages[i : i + BATCH_SIZE]]
+                    in_flight.add(executor.submit(fetch_batch, batch_ids))
+                continue
+
+            done, _ = wait(in_flight | parsing, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in in_flight:
+                    # Hand fetched messages to the parsers without waiting for them
+                    in_flight.remove(future)
+                    try:
+                        raws = future.result()
+                    except Exception as e:
+                        logger.error(f"Unexpected error: {e}")
+                        continue
+                    for i in range(0, len(raws), PARSE_CHUNK):
+                        parsing.add(parser.submit(parse_batch, raws[i : i + PARSE_CHUNK]))
+                else:
+                    parsing.remove(future)
+                    try:
+                        batch.extend(future.result())
+                    except Exception as e:
+                        logger.error(f"Unexpected error: {e}")
+
+                    if len(batch) >= FLUSH_ROWS:
+                        queue_write(writes, writer, batch)
+                        batch = MessageBatch()
 
     if batch:
-        save_to_duckdb(batch)
+        queue_write(writes, writer, batch)
 
     return total_messages
 
 
-def fetch_message_batch(service, message_ids, labels):
+def _parser_context():
+    """
+    Returns the multiprocessing context for parser processes.
+
+    forkserver is preferred so workers are never fork()ed from this
+    multi-threaded process; platforms without it use spawn.
     """
-    Fetches a batch of messages from Gmail API using individual requests.
-    
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def raise_if_stopped(writer):
+    """
+    Raises if the writer thread has stopped, re-raising its error if it failed.
+
     Args:
-        service: Gmail API service instance.
-        message_ids: List of message IDs to fetch.
-        labels: Dictionary mapping label IDs to label names.
-    
-    Returns:
-        list[dict]: Parsed message records.
+        writer (Future): The writer thread.
     """
-    messages = []
-    
-    for message_id in message_ids:
-        try:
-            msg = service.users().messages().get(userId="me", id=message_id, format="full").execute()
-            messages.append(Message.from_raw(msg, labels).__dict__)
-        except Exception as e:
-            logger.error(f"Failed to fetch message {message_id}: {e}")
-    
-    return messages
+    if writer.done():
+        writer.result()
+        raise RuntimeError("DuckDB writer stopped before the sync finished")
 
 
-def save_to_duckdb(messages):
+def queue_write(writes, writer, item):
     """
-    Inserts messages into DuckDB in bulk.
+    Hands an item to the writer thread without blocking on a writer that has stopped.
 
     Args:
-        messages (list[dict]): List of messages to insert.
+        writes (Queue): Queue consumed by the writer.
+        writer (Future): The writer thread.
+        item: A MessageBatch, or the None/_ABORT sentinel.
     """
-    if not messages:
-        return
+    while True:
+        raise_if_stopped(writer)
+        try:
+            writes.put(item, timeout=WRITE_POLL_INTERVAL)
+            return
+        except Full:
+            continue
 
-    df = pd.DataFrame(messages)
-    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
-    df["last_indexed"] = pd.Timestamp.now(tz="UTC")
 
-    conn.execute("INSERT INTO messages SELECT * FROM df")
-    logger.info(f"Inserted {len(messages)} messages into DuckDB.")
+def write_batches(db, writes):
+    """
+    Writes queued message batches to DuckDB until the producer is done.
 
+    All batches are written in one transaction so a single WAL flush covers
+    the whole sync. A None item commits it and _ABORT rolls it back. If a
+    write fails, the transaction is rolled back and the writer stops; the
+    producer notices through the returned future and aborts.
 
-def get_last_indexed_timestamp():
+    Args:
+        db (DuckDB): Database cursor owned by the writer thread.
+        writes (Queue): Queue of MessageBatch objects.
     """
-    Retrieves the latest indexed message timestamp from DuckDB.
+    try:
+        db.conn.begin()
+        while True:
+            batch = writes.get()
+            if batch is None:
+                break
+            if batch is _ABORT:
+                db.conn.rollback()
+                return
+            save_to_duckdb(db, batch)
+        db.conn.commit()
+    except BaseException:
+        with suppress(Exception):
+            db.conn.rollback()
+        raise
+
+
+def fetch_message_batch(service, message_ids, http=None):
+    """
+    Fetches a batch of messages from Gmail API using batch HTTP requests.
+
+    Up to BATCH_SIZE message GETs are coalesced into a single HTTP round-trip.
+    Throttled messages and chunks that hit a transport error are retried with
+    jittered exponential backoff.
+
+    Args:
+        service: Gmail API service instance.
+        message_ids: List of message IDs to fetch.
+        http: HTTP client to execute the requests with; defaults to the service's.
 
     Returns:
-        datetime.datetime or None: The last indexed timestamp.
+        list[dict]: Raw Gmail API messages.
+    """
+    messages = []
+    throttled = []
+
+    def _collect(request_id, response, exception):
+        if exception is not None:
+            if isinstance(exception, HttpError) and exception.resp.status in RETRY_STATUSES:
+                throttled.append(request_id)
+            else:
+                logger.error(f"Failed to fetch message {request_id}: {exception}")
+            return
+        messages.append(response)
+
+    pending = list(message_ids)
+    for attempt in range(MAX_RETRIES + 1):
+        for i in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[i : i + BATCH_SIZE]
+            batch = service.new_batch_http_request()
+            for message_id in chunk:
+                batch.add(
+                    service.users().messages().get(userId="me", id=message_id, format="full"),
+                    request_id=message_id,
+                    callback=_collect,
+                )
+            try:
+                batch.execute(http=http)
+            except HttpError as e:
+                if e.resp.status in RETRY_STATUSES:
+                    throttled.extend(chunk)
+                else:
+                    logger.error(f"Batch request failed for messages {', '.join(chunk)}: {e}")
+            except TRANSPORT_ERRORS as e:
+                logger.warning(f"Batch request failed, retrying {len(chunk)} messages: {e}")
+                throttled.extend(chunk)
+
+        if not throttled:
+            break
+        if attempt == MAX_RETRIES:
+            logger.error(f"Giving up on {len(throttled)} messages: {', '.join(throttled)}")
+            break
+
+        # Jitter keeps concurrent workers from retrying in lockstep
+        time.sleep(random.uniform(0.5, 1.5) * RETRY_BASE_DELAY * 2**attempt)
+        pending = throttled[:]
+        throttled.clear()
+
+    return messages
+
+
+def save_to_duckdb(db, batch):
     """
-    result = conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()
-    return result[0] if result[0] else None
+    Upserts messages into DuckDB in bulk.
+
+    Incremental syncs usually list the newest stored message again, so rows
+    that already exist only get their read status and labels refreshed
+    instead of failing the sync transaction.
+
+    Args:
+        db (DuckDB): Database the messages are written to.
+        batch (MessageBatch): Messages to insert or update.
+    """
+    if not batch:
+        return
+
+    db.upsert_messages(batch)
+    logger.info(f"Upserted {len(batch)} messages into DuckDB.")
 
 
 if __name__ == "__main__":
     credentials = get_credentials(".")
-    total_synced = fetch_all_messages(credentials, full_sync=False)
+    total_synced = fetch_all_messages(credentials, DuckDB("."), full_sync=False)
     logger.info(f"Total messages synced: {total_synced}")
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("selectolax.lexbor")
+
+import message
+from message import Message
+
+NEWSLETTER = (
+    "<html><head><style>body{margin:0} .btn{color:#fff}</style></head>"
+    "<body><p>Newsletter</p>\n<script>var x=1;</script>"
+    "<p>Your order <b>#123</b> ships to<i>day</i>.</p></body></html>"
+)
+
+
+@pytest.mark.parametrize("html", [NEWSLETTER, "<p>Hello <b>0</b></p>"])
+def test_html2text_matches_beautifulsoup(html, monkeypatch):
+    text = Message().html2text(html)
+
+    monkeypatch.setattr(message, "LexborHTMLParser", None)
+    assert text == Message().html2text(html)
+
+
+def test_html2text_drops_style_and_script():
+    assert Message().html2text(NEWSLETTER) == "Newsletter\nYour order #123 ships today."